@@ -1,5 +1,16 @@
 """Run: python -m sketchyapi"""
+import os
 import uvicorn
 from .config import settings
 
-uvicorn.run("sketchyapi.main:app", host=settings.api_host, port=settings.api_port, reload=settings.debug)
+if settings.debug:
+    uvicorn.run("sketchyapi.main:app", host=settings.api_host, port=settings.api_port, reload=True)
+else:
+    uvicorn.run(
+        "sketchyapi.main:app",
+        host=settings.api_host,
+        port=settings.api_port,
+        loop="uvloop",
+        http="httptools",
+        workers=settings.api_workers or os.cpu_count(),
+    )
@@ -19,7 +19,7 @@ async def require_auth(api_key: str = Security(api_key_header)) -> AuthInfo:
     if not api_key:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing X-API-Key header")
 
-    keys = settings.parse_api_keys()
+    keys = settings.parsed_api_keys
 
     # If no keys configured, allow all (dev mode)
     if not keys:
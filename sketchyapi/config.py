@@ -1,8 +1,10 @@
 """Configuration — all settings from environment variables."""
 
+from functools import cached_property
 from pathlib import Path
+from types import MappingProxyType
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Mapping, Optional
 
 
 class Settings(BaseSettings):
@@ -11,6 +13,7 @@ class Settings(BaseSettings):
     api_version: str = "0.1.0"
     api_host: str = "0.0.0.0"
     api_port: int = 8000
+    api_workers: int = 0  # uvicorn worker processes for `python -m sketchyapi`; 0 = one per CPU
     debug: bool = False
 
     # Auth
@@ -24,6 +27,8 @@ class Settings(BaseSettings):
     comfyui_url: str = "http://localhost:8188"
     comfyui_checkpoint: str = "flux1-dev-fp8.safetensors"
     comfyui_steps: int = 20
+    comfyui_concurrency: int = 4  # ComfyUI workflows in flight per job
+    comfyui_batch_size: int = 1  # Panels rendered per ComfyUI workflow (shared model load)
 
     # Queue
     queue_backend: str = "sqlite"  # "sqlite" | "redis" (future)
@@ -37,6 +42,7 @@ class Settings(BaseSettings):
     # Worker
     worker_poll_interval: int = 5
     worker_max_concurrent: int = 1
+    job_deadline: int = 1800  # Seconds a job may run end-to-end before it is failed
 
     # Script writer
     script_writer_backend: str = "stub"  # "stub" | "prompt_only" | "openai" | "anthropic"
@@ -48,10 +54,13 @@ class Settings(BaseSettings):
     rate_limit_free: int = 5
     rate_limit_pro: int = 50
     rate_limit_enterprise: int = 500
+    rate_limit_cache_ttl: int = 30  # Seconds /balance reuses a per-key usage count before re-counting
 
     # Webhook
     webhook_timeout: int = 10
     webhook_max_retries: int = 3
+    webhook_breaker_threshold: int = 5  # Consecutive failed deliveries before a URL is skipped
+    webhook_breaker_cooldown: int = 60  # Seconds before a skipped URL gets a trial delivery
 
     # Public base URL
     base_url: str = "http://localhost:8000"
@@ -68,18 +77,20 @@ class Settings(BaseSettings):
     def resolved_sqlite_path(self) -> Path:
         return Path(self.sqlite_path)
 
-    def parse_api_keys(self) -> dict[str, str]:
-        if not self.api_keys:
-            return {}
+    @cached_property
+    def parsed_api_keys(self) -> Mapping[str, str]:
+        """Read-only key → tier map, parsed once from the comma-separated "key:tier" pairs."""
         result = {}
         for entry in self.api_keys.split(","):
             entry = entry.strip()
+            if not entry:
+                continue
             if ":" in entry:
                 key, tier = entry.rsplit(":", 1)
                 result[key] = tier
             else:
                 result[entry] = "free"
-        return result
+        return MappingProxyType(result)
 
     def rate_limit_for_tier(self, tier: str) -> int:
         return {
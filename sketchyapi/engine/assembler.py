@@ -1,16 +1,68 @@
 """Comic panel assembler — combines individual panels into a comic grid."""
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, NamedTuple
 from PIL import Image, ImageDraw, ImageFont
 
 
 PANEL_W, PANEL_H = 512, 512
 BORDER, MARGIN, PADDING = 4, 8, 20
 TITLE_H = 80
+BUBBLE_H, BUBBLE_TAIL_H = 140, 12
+BORDER_COLOR = (0, 0, 0)
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+TITLE_FONT_SIZE, DIALOGUE_FONT_SIZE = 38, 16
 
+# Freed image blocks Pillow keeps for reuse. Pillow's default of 0 hands every panel, resize and
+# canvas buffer back to the OS (munmap) and faults fresh pages in for the next one.
+PIL_BLOCKS_MAX = 32
 
-def assemble_comic(panels: list[tuple[bytes, str]], title: str, num_panels: int) -> bytes:
-    """Assemble panels into a combined comic grid. Returns PNG bytes."""
+# Parsed once per process; see _get_fonts()
+_TITLE_FONT = None
+_DIALOGUE_FONT = None
+_FONT_LOCK = threading.Lock()
+
+
+def init_pil(blocks_max: int = PIL_BLOCKS_MAX) -> None:
+    """Let Pillow recycle image memory across panels and jobs; PILLOW_BLOCKS_MAX in the env wins."""
+    if "PILLOW_BLOCKS_MAX" not in os.environ:
+        Image.core.set_blocks_max(blocks_max)
+
+
+def _load_font(size: int):
+    try:
+        return ImageFont.truetype(FONT_PATH, size)
+    except Exception:
+        return ImageFont.load_default()
+
+
+def _get_fonts():
+    """Return the (title, dialogue) fonts, loading them on first use."""
+    global _TITLE_FONT, _DIALOGUE_FONT
+    if _DIALOGUE_FONT is None:
+        with _FONT_LOCK:
+            if _DIALOGUE_FONT is None:
+                _TITLE_FONT = _load_font(TITLE_FONT_SIZE)
+                _DIALOGUE_FONT = _load_font(DIALOGUE_FONT_SIZE)
+    return _TITLE_FONT, _DIALOGUE_FONT
+
+
+class _Layout(NamedTuple):
+    width: int
+    height: int
+    panel_w: int  # panel size including border
+    panel_h: int
+    positions: tuple[tuple[int, int], ...]  # top-left of each bordered panel, row-major
+
+
+@lru_cache(maxsize=16)
+def _layout(num_panels: int) -> _Layout:
+    """Canvas size and panel positions for a grid of num_panels."""
     if num_panels <= 6:
         cols, rows = 2, 3
     elif num_panels <= 9:
@@ -25,68 +77,127 @@ def assemble_comic(panels: list[tuple[bytes, str]], title: str, num_panels: int)
     ph = PANEL_H + 2 * BORDER
     cw = cols * pw + (cols - 1) * MARGIN + 2 * PADDING
     ch = TITLE_H + rows * ph + (rows - 1) * MARGIN + 2 * PADDING
+    positions = tuple(
+        (PADDING + col * (pw + MARGIN), TITLE_H + PADDING + row * (ph + MARGIN))
+        for row in range(rows)
+        for col in range(cols)
+    )
+    return _Layout(cw, ch, pw, ph, positions)
+
+
+def assemble_comic(
+    panels: list[tuple[bytes | str | Path, str]],
+    title: str,
+    num_panels: int,
+    output: str | Path | BinaryIO | None = None,
+) -> bytes | None:
+    """Assemble panels into a combined comic grid.
+
+    Each panel is (PNG bytes or path to a PNG file, dialogue). Writes the PNG to ``output``
+    (a path or writable binary file) and returns None, or returns the PNG bytes when no
+    output is given.
+    """
+    cw, ch, pw, ph, positions = _layout(num_panels)
 
     comic = Image.new("RGB", (cw, ch), (24, 24, 27))
     draw = ImageDraw.Draw(comic)
 
-    # Title
-    try:
-        tf = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 38)
-    except Exception:
-        tf = ImageFont.load_default()
-    bbox = draw.textbbox((0, 0), title, font=tf)
-    draw.text(((cw - bbox[2]) // 2, 25), title, fill=(255, 255, 255), font=tf)
-
-    # Dialogue font
-    try:
-        df = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 16)
-    except Exception:
-        df = ImageFont.load_default()
+    tf, df = _get_fonts()
 
-    for i, (img_bytes, dialogue) in enumerate(panels):
-        row, col = i // cols, i % cols
-        img = Image.open(BytesIO(img_bytes)).convert("RGB").resize((PANEL_W, PANEL_H))
+    # Title
+    title_w = int(tf.getlength(title))
+    draw.text(((cw - title_w) // 2, 25), title, fill=(255, 255, 255), font=tf)
 
-        bordered = Image.new("RGB", (pw, ph), (0, 0, 0))
-        bordered.paste(img, (BORDER, BORDER))
+    # Decode/resize in parallel (Pillow releases the GIL); paste serially onto the shared canvas
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        images = list(pool.map(_prep_panel, [src for src, _ in panels]))
 
-        x = PADDING + col * (pw + MARGIN)
-        y = TITLE_H + PADDING + row * (ph + MARGIN)
-        comic.paste(bordered, (x, y))
+    for img, (_, dialogue), (x, y) in zip(images, panels, positions):
+        draw.rectangle([x, y, x + pw - 1, y + ph - 1], fill=BORDER_COLOR)
+        comic.paste(img, (x + BORDER, y + BORDER))
 
         if dialogue:
-            _draw_bubble(draw, dialogue, x, y, pw, ph, df)
+            _draw_bubble(comic, dialogue, x, y, pw, ph, df)
 
+    if output is not None:
+        comic.save(output, format="PNG", compress_level=1)
+        return None
     buf = BytesIO()
-    comic.save(buf, format="PNG", quality=95)
+    comic.save(buf, format="PNG", compress_level=1)
     return buf.getvalue()
 
 
-def _draw_bubble(draw, text, px, py, pw, ph, font, bh=140):
-    words = text.split()
-    max_w = pw - 30
-    lines, cur = [], []
-    for w in words:
-        t = " ".join(cur + [w])
-        if draw.textbbox((0, 0), t, font=font)[2] <= max_w:
-            cur.append(w)
-        else:
-            if cur:
-                lines.append(" ".join(cur))
-            cur = [w]
-    if cur:
-        lines.append(" ".join(cur))
-    if not lines:
+def _prep_panel(src: bytes | str | Path) -> Image.Image:
+    """Decode a panel PNG (bytes or file path) as RGB at PANEL_W×PANEL_H."""
+    # ComfyUI renders PNGs at PANEL_W×PANEL_H already; only convert/resize when needed
+    img = Image.open(BytesIO(src) if isinstance(src, bytes) else src, formats=["PNG"])
+    img.load()
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != (PANEL_W, PANEL_H):
+        img = img.resize((PANEL_W, PANEL_H), Image.BILINEAR)
+    return img
+
+
+@lru_cache(maxsize=4096)
+def _text_width(font, text: str) -> float:
+    """Advance width of text; fonts are process-wide singletons, so widths are memoized."""
+    return font.getlength(text)
+
+
+def _draw_bubble(comic, text, px, py, pw, ph, font, bh=BUBBLE_H):
+    tile = _bubble_tile(text, font, pw - 20, bh)
+    if tile is None:
         return
+    img, top = tile
+    comic.paste(img, (px + 10, py + ph - bh - 10 + top), img)
+
 
-    x, y = px + 10, py + ph - bh - 10
-    bw = pw - 20
-    draw.rounded_rectangle([x, y, x + bw, y + bh], radius=10, fill=(255, 255, 255, 245), outline=(0, 0, 0), width=2)
-    tx = x + bw // 3
-    draw.polygon([(tx, y), (tx + 15, y), (tx + 7, y - 12)], fill=(255, 255, 255), outline=(0, 0, 0))
+@lru_cache(maxsize=64)
+def _bubble_tile(text, font, bw, bh) -> tuple[Image.Image, int] | None:
+    """Rasterize a speech bubble on a small RGBA tile.
+
+    Returns the tile and the offset of its top edge from the bubble's top (negative: the tail
+    sticks out above), or None when there is nothing to say. Drawing on a tile instead of the
+    full canvas keeps every draw op small, and repeated dialogue reuses the cached tile.
+    """
+    lines = _wrap_lines(text, font, bw - 10)
+    if not lines:
+        return None
 
     line_h = font.size + 4
     total_h = len(lines) * line_h
-    sy = y + (bh - total_h) // 2
+    sy = (bh - total_h) // 2
+    top = min(-BUBBLE_TAIL_H, sy)
+    bottom = max(bh, sy + total_h)
+    # A word wider than the bubble overflows to the right, as it would drawn straight on the canvas
+    right = max(bw, max(10 + font.getbbox(line)[2] for line in lines))
+
+    tile = Image.new("RGBA", (right + 1, bottom - top + 1), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(tile)
+    y = -top
+    draw.rounded_rectangle([0, y, bw, y + bh], radius=10, fill=(255, 255, 255), outline=(0, 0, 0), width=2)
+    tx = bw // 3
+    draw.polygon([(tx, y), (tx + 15, y), (tx + 7, y - BUBBLE_TAIL_H)], fill=(255, 255, 255), outline=(0, 0, 0))
     for i, line in enumerate(lines):
-        draw.text((x + 10, sy + i * line_h), line, fill=(0, 0, 0), font=font)
+        draw.text((10, y + sy + i * line_h), line, fill=(0, 0, 0), font=font)
+    return tile, top
+
+
+def _wrap_lines(text, font, max_w) -> list[str]:
+    words = text.split()
+    # Measure each word once and track the running line width instead of re-measuring the line
+    space_w = _text_width(font, " ")
+    lines, cur, cur_w = [], [], 0.0
+    for w in words:
+        ww = _text_width(font, w)
+        add = ww if not cur else space_w + ww
+        if not cur or cur_w + add <= max_w:
+            cur.append(w)
+            cur_w += add
+        else:
+            lines.append(" ".join(cur))
+            cur, cur_w = [w], ww
+    if cur:
+        lines.append(" ".join(cur))
+    return lines
@@ -1,8 +1,21 @@
 """ComfyUI image generation engine."""
 
+import json
 import random
+import threading
 import time
-import requests as req
+import uuid
+from functools import lru_cache
+
+import httpx
+from websockets.sync.client import connect as ws_connect, unix_connect as ws_unix_connect
+
+UNIX_PREFIX = "unix:"  # e.g. SKETCHY_COMFYUI_URL=unix:/run/comfyui.sock
+PANEL_TIMEOUT = 300  # seconds per panel, counted from when ComfyUI starts running the prompt
+CANCEL_POLL = 1.0  # seconds between checks of the cancel event while waiting on ComfyUI
+
+
+DEFAULT_NEGATIVE_PROMPT = "photograph, photo, realistic, 3d render, animal, cat, dog, bear, lion, eagle, wolf, fox, owl, bird, furry, anthropomorphic, cartoon animal, animal character, blurry, deformed, ugly, watermark, signature, black and white, grayscale, monochrome, sepia, desaturated"
 
 
 def generate_image(
@@ -13,41 +26,147 @@ def generate_image(
     seed: int | None = None,
     width: int = 512,
     height: int = 512,
-    negative_prompt: str = "photograph, photo, realistic, 3d render, animal, cat, dog, bear, lion, eagle, wolf, fox, owl, bird, furry, anthropomorphic, cartoon animal, animal character, blurry, deformed, ugly, watermark, signature, black and white, grayscale, monochrome, sepia, desaturated",
+    negative_prompt: str = DEFAULT_NEGATIVE_PROMPT,
 ) -> bytes:
     """Send a prompt to ComfyUI and return image bytes."""
+    return generate_images([prompt], server, checkpoint, steps, seed, width, height, negative_prompt)[0]
+
+
+def generate_images(
+    prompts: list[str],
+    server: str,
+    checkpoint: str,
+    steps: int = 20,
+    seed: int | None = None,
+    width: int = 512,
+    height: int = 512,
+    negative_prompt: str = DEFAULT_NEGATIVE_PROMPT,
+    deadline: float | None = None,
+    cancel: threading.Event | None = None,
+) -> list[bytes]:
+    """Render several prompts as one ComfyUI workflow and return image bytes in prompt order.
+
+    The checkpoint, negative conditioning and empty latent are shared by every prompt's
+    sampler chain, so the graph is queued, scheduled and loaded once per batch.
+
+    ``deadline`` (a time.monotonic() value) bounds the whole call, including time spent queued
+    behind other prompts; once ComfyUI starts the prompt it also gets PANEL_TIMEOUT per panel.
+    Setting ``cancel`` abandons the call. On timeout, cancel or error the prompt is removed from
+    ComfyUI's queue (or interrupted if running) so it stops holding the GPU.
+    """
     if seed is None:
         seed = random.randint(1, 2**31)
 
     workflow = {
         "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": checkpoint}},
         "5": {"class_type": "EmptyLatentImage", "inputs": {"width": width, "height": height, "batch_size": 1}},
-        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": prompt, "clip": ["4", 1]}},
         "7": {"class_type": "CLIPTextEncode", "inputs": {"text": negative_prompt, "clip": ["4", 1]}},
-        "10": {"class_type": "FluxGuidance", "inputs": {"guidance": 3.5, "conditioning": ["6", 0]}},
-        "3": {"class_type": "KSampler", "inputs": {
-            "seed": seed, "steps": steps, "cfg": 1.0, "sampler_name": "euler",
-            "scheduler": "simple", "denoise": 1, "model": ["4", 0],
-            "positive": ["10", 0], "negative": ["7", 0], "latent_image": ["5", 0],
-        }},
-        "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
-        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "api_panel", "images": ["8", 0]}},
     }
+    save_nodes = []
+    for n, prompt in enumerate(prompts):
+        pos, guide, sample, decode, save = (f"{nid}_{n}" for nid in ("6", "10", "3", "8", "9"))
+        workflow[pos] = {"class_type": "CLIPTextEncode", "inputs": {"text": prompt, "clip": ["4", 1]}}
+        workflow[guide] = {"class_type": "FluxGuidance", "inputs": {"guidance": 3.5, "conditioning": [pos, 0]}}
+        workflow[sample] = {"class_type": "KSampler", "inputs": {
+            "seed": seed + n, "steps": steps, "cfg": 1.0, "sampler_name": "euler",
+            "scheduler": "simple", "denoise": 1, "model": ["4", 0],
+            "positive": [guide, 0], "negative": ["7", 0], "latent_image": ["5", 0],
+        }}
+        workflow[decode] = {"class_type": "VAEDecode", "inputs": {"samples": [sample, 0], "vae": ["4", 2]}}
+        workflow[save] = {"class_type": "SaveImage", "inputs": {"filename_prefix": "api_panel", "images": [decode, 0]}}
+        save_nodes.append(save)
+
+    # Subscribe to progress events before queueing so none are missed
+    client_id = uuid.uuid4().hex
+    if deadline is not None and deadline <= time.monotonic():
+        raise TimeoutError("ComfyUI generation timed out")
+    client = _client(server)
+    outputs: dict[str, dict] = {}
+    started = False
+    with _ws_connect(server, client_id) as ws:
+        resp = client.post("/prompt", json={"prompt": workflow, "client_id": client_id})
+        resp.raise_for_status()
+        prompt_id = resp.json()["prompt_id"]
+
+        try:
+            while len(outputs) < len(save_nodes):
+                if cancel is not None and cancel.is_set():
+                    raise RuntimeError("ComfyUI generation cancelled")
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    raise TimeoutError("ComfyUI generation timed out")
+                if cancel is not None:
+                    timeout = CANCEL_POLL if timeout is None else min(timeout, CANCEL_POLL)
+                try:
+                    msg = ws.recv(timeout=timeout)
+                except TimeoutError:
+                    continue  # re-check cancel and the deadline
+                if isinstance(msg, bytes):  # latent previews
+                    continue
+
+                event = json.loads(msg)
+                data = event.get("data") or {}
+                if data.get("prompt_id") != prompt_id:
+                    continue
+                if event.get("type") == "execution_start":
+                    # Time queued behind other prompts doesn't count against the per-panel budget
+                    started = True
+                    run_deadline = time.monotonic() + PANEL_TIMEOUT * len(prompts)
+                    deadline = run_deadline if deadline is None else min(deadline, run_deadline)
+                elif event.get("type") == "executed" and data.get("node") in save_nodes:
+                    outputs[data["node"]] = data["output"]["images"][0]
+                elif event.get("type") == "execution_error":
+                    raise RuntimeError(f"ComfyUI execution failed: {data.get('exception_message', 'unknown error')}")
+                elif event.get("type") == "executing" and data.get("node") is None:
+                    # Prompt finished without "executed" events for some SaveImage nodes (cached outputs)
+                    hist = client.get(f"/history/{prompt_id}", timeout=10).json()[prompt_id]["outputs"]
+                    for node in save_nodes:
+                        outputs.setdefault(node, hist[node]["images"][0])
+        except BaseException:
+            _abandon_prompt(client, prompt_id, started)
+            raise
+
+    return [_fetch_image(client, outputs[node]) for node in save_nodes]
+
+
+@lru_cache(maxsize=4)
+def _client(server: str) -> httpx.Client:
+    """Shared keep-alive client per ComfyUI server; HTTP/2 over TLS, or a UNIX socket for ``unix:`` URLs."""
+    # Transport retries only cover failed connects, so a /prompt POST is never sent twice
+    if server.startswith(UNIX_PREFIX):
+        transport = httpx.HTTPTransport(uds=server[len(UNIX_PREFIX):], retries=3)
+        return httpx.Client(transport=transport, base_url="http://comfyui", timeout=30)
+    transport = httpx.HTTPTransport(
+        http2=True, retries=3, limits=httpx.Limits(max_connections=16, max_keepalive_connections=4),
+    )
+    return httpx.Client(transport=transport, base_url=server, timeout=30)
+
+
+def _ws_connect(server: str, client_id: str):
+    if server.startswith(UNIX_PREFIX):
+        return ws_unix_connect(
+            server[len(UNIX_PREFIX):], f"ws://comfyui/ws?clientId={client_id}", open_timeout=30, max_size=None,
+        )
+    scheme, _, rest = server.partition("://")
+    url = f"{'wss' if scheme == 'https' else 'ws'}://{rest}/ws?clientId={client_id}"
+    return ws_connect(url, open_timeout=30, max_size=None)
+
+
+def _abandon_prompt(client: httpx.Client, prompt_id: str, started: bool) -> None:
+    """Best-effort removal of a prompt whose result is no longer wanted."""
+    try:
+        client.post("/queue", json={"delete": [prompt_id]}, timeout=5)
+        if started:
+            # ComfyUI runs one prompt at a time, so an unfinished started prompt is the running one;
+            # servers that understand prompt_id only interrupt it if it is.
+            client.post("/interrupt", json={"prompt_id": prompt_id}, timeout=5)
+    except httpx.HTTPError:
+        pass
+
 
-    resp = req.post(f"{server}/prompt", json={"prompt": workflow}, timeout=30)
-    resp.raise_for_status()
-    prompt_id = resp.json()["prompt_id"]
-
-    for _ in range(300):  # max ~5 min per panel
-        hist = req.get(f"{server}/history/{prompt_id}", timeout=10).json()
-        if prompt_id in hist and "9" in hist[prompt_id].get("outputs", {}):
-            img_info = hist[prompt_id]["outputs"]["9"]["images"][0]
-            img_resp = req.get(
-                f"{server}/view",
-                params={"filename": img_info["filename"], "subfolder": img_info.get("subfolder", ""), "type": "output"},
-                timeout=30,
-            )
-            return img_resp.content
-        time.sleep(1)
-
-    raise TimeoutError("ComfyUI generation timed out")
+def _fetch_image(client: httpx.Client, img_info: dict) -> bytes:
+    img_resp = client.get(
+        "/view",
+        params={"filename": img_info["filename"], "subfolder": img_info.get("subfolder", ""), "type": "output"},
+    )
+    return img_resp.content
@@ -2,12 +2,16 @@
 
 from __future__ import annotations
 import asyncio
+import hashlib
 import logging
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 
+import httpx
 from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.responses import Response
+from fastapi.responses import FileResponse, Response
+from pydantic import TypeAdapter
 
 from .config import settings
 from .auth import AuthInfo, require_auth
@@ -16,7 +20,7 @@ from .models import (
     BalanceResponse, WebhookTestRequest, WebhookPayload,
 )
 from .queue_service import QueueBackend, create_queue
-from .storage import StorageBackend, create_storage
+from .storage import LocalStorage, StorageBackend, create_storage
 from .worker import send_webhook
 
 logger = logging.getLogger("sketchy.api")
@@ -24,16 +28,30 @@ logger = logging.getLogger("sketchy.api")
 # --- Globals (initialized at startup) ---
 queue: QueueBackend
 storage: StorageBackend
+webhook_client: httpx.AsyncClient
+
+_PANELS_ADAPTER = TypeAdapter(list[PanelInfo])
+
+# Stored outputs are written once under a unique job id and never change
+_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+# api_key -> (requests in the last hour, monotonic time that count was read from the queue)
+_usage_cache: dict[str, tuple[int, float]] = {}
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global queue, storage
+    global queue, storage, webhook_client
     queue = create_queue()
     storage = create_storage()
+    webhook_client = httpx.AsyncClient(
+        timeout=settings.webhook_timeout,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    )
     settings.resolved_output_dir.mkdir(parents=True, exist_ok=True)
     logger.info("SketchyNews API ready")
     yield
+    await webhook_client.aclose()
 
 
 app = FastAPI(
@@ -47,7 +65,7 @@ app = FastAPI(
 
 def _job_to_response(job) -> ComicJob:
     result = job.result or {}
-    panels = [PanelInfo(**p) for p in result.get("panels", [])]
+    panels = _PANELS_ADAPTER.validate_python(result.get("panels", []))
     return ComicJob(
         job_id=job.job_id,
         status=job.status,
@@ -63,10 +81,45 @@ def _job_to_response(job) -> ComicJob:
     )
 
 
+def _requests_used(api_key: str, fresh: bool = False) -> int:
+    """Requests in the last hour, re-counted from the queue at most every rate_limit_cache_ttl seconds.
+
+    ``fresh`` always re-counts: other API processes enqueue for the same key, so only the queue's
+    count is safe to enforce a limit against.
+    """
+    now = time.monotonic()
+    cached = _usage_cache.get(api_key)
+    if not fresh and cached and now - cached[1] < settings.rate_limit_cache_ttl:
+        return cached[0]
+    since = datetime.now(timezone.utc) - timedelta(hours=1)
+    used = queue.count_requests(api_key, since)
+    _usage_cache[api_key] = (used, now)
+    return used
+
+
+def _record_request(api_key: str):
+    cached = _usage_cache.get(api_key)
+    if cached:
+        _usage_cache[api_key] = (cached[0] + 1, cached[1])
+
+
+def _file_response(key: str, media_type: str, not_found: str) -> Response:
+    """Serve a stored file; local files are streamed with sendfile instead of read into memory."""
+    headers = {"Cache-Control": _IMMUTABLE_CACHE, "ETag": f'"{hashlib.sha1(key.encode()).hexdigest()}"'}
+    if isinstance(storage, LocalStorage):
+        path = storage.path_for(key)
+        if not path.is_file():
+            raise HTTPException(404, not_found)
+        return FileResponse(path, media_type=media_type, headers=headers)
+    data = storage.get(key)
+    if not data:
+        raise HTTPException(404, not_found)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
 def _check_rate_limit(auth: AuthInfo):
     limit = settings.rate_limit_for_tier(auth.tier)
-    since = datetime.now(timezone.utc) - timedelta(hours=1)
-    used = queue.count_requests(auth.api_key, since)
+    used = _requests_used(auth.api_key, fresh=True)
     if used >= limit:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
@@ -82,6 +135,7 @@ async def create_comic(req: ComicRequest, auth: AuthInfo = Depends(require_auth)
     """Submit a comic generation job."""
     _check_rate_limit(auth)
     job = queue.enqueue(auth.api_key, req)
+    _record_request(auth.api_key)
     return _job_to_response(job)
 
 
@@ -98,20 +152,14 @@ async def get_comic(job_id: str, auth: AuthInfo = Depends(require_auth)):
 async def get_panel(job_id: str, n: int, auth: AuthInfo = Depends(require_auth)):
     """Download individual panel image."""
     key = f"{job_id}/panels/panel_{n:02d}.png"
-    data = storage.get(key)
-    if not data:
-        raise HTTPException(404, "Panel not found")
-    return Response(content=data, media_type="image/png")
+    return _file_response(key, "image/png", "Panel not found")
 
 
 @app.get("/api/v1/comic/{job_id}/combined")
 async def get_combined(job_id: str, auth: AuthInfo = Depends(require_auth)):
     """Download combined comic image."""
     key = f"{job_id}/combined.png"
-    data = storage.get(key)
-    if not data:
-        raise HTTPException(404, "Comic not found (still generating?)")
-    return Response(content=data, media_type="image/png")
+    return _file_response(key, "image/png", "Comic not found (still generating?)")
 
 
 @app.get("/api/v1/balance", response_model=BalanceResponse)
@@ -119,7 +167,7 @@ async def get_balance(auth: AuthInfo = Depends(require_auth)):
     """Check usage and quota."""
     since = datetime.now(timezone.utc) - timedelta(hours=1)
     limit = settings.rate_limit_for_tier(auth.tier)
-    used = queue.count_requests(auth.api_key, since)
+    used = _requests_used(auth.api_key)
     return BalanceResponse(
         tier=auth.tier,
         requests_used=used,
@@ -140,7 +188,9 @@ async def test_webhook(req: WebhookTestRequest, auth: AuthInfo = Depends(require
         panels_count=18,
         title="Test Webhook Delivery",
     )
-    ok = await send_webhook(req.url, payload)
+    # One attempt, always sent: a test reports whether delivery works now, not after retries or
+    # from a previous failure streak
+    ok = await send_webhook(req.url, payload, webhook_client, use_breaker=False, retries=0)
     if not ok:
         raise HTTPException(502, "Webhook delivery failed")
     return {"status": "ok", "message": "Test webhook delivered successfully"}
@@ -151,11 +201,8 @@ async def test_webhook(req: WebhookTestRequest, auth: AuthInfo = Depends(require
 @app.get("/files/{path:path}")
 async def serve_file(path: str):
     """Serve stored files (local storage only)."""
-    data = storage.get(path)
-    if not data:
-        raise HTTPException(404, "File not found")
     ct = "image/png" if path.endswith(".png") else "image/webp" if path.endswith(".webp") else "application/octet-stream"
-    return Response(content=data, media_type=ct)
+    return _file_response(path, ct, "File not found")
 
 
 @app.get("/health")
@@ -2,12 +2,15 @@
 
 from __future__ import annotations
 import abc
-import json
+import asyncio
 import sqlite3
+import threading
 import uuid
 from datetime import datetime, timezone
 from typing import Optional
 
+import orjson
+
 from .models import ComicRequest, JobStatus
 
 
@@ -38,15 +41,40 @@ class QueueBackend(abc.ABC):
     @abc.abstractmethod
     def count_requests(self, api_key: str, since: datetime) -> int: ...
 
+    async def wait_for_job(self, timeout: float) -> Optional[Job]:
+        """Claim the next pending job, waiting up to ``timeout`` seconds for one to arrive.
+
+        Backends with push semantics (BLPOP, long-poll) should override this; the default polls once.
+        """
+        job = self.next_pending()
+        if job is None:
+            await asyncio.sleep(timeout)
+        return job
+
+    async def update_status_async(self, job_id: str, status: JobStatus, **kwargs) -> None:
+        """update_status without blocking the event loop; backends with an async client should override."""
+        await asyncio.to_thread(self.update_status, job_id, status, **kwargs)
+
 
 class SQLiteQueue(QueueBackend):
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, watch_interval: float = 0.2):
         self.db_path = db_path
+        self.watch_interval = watch_interval
+        self._local = threading.local()
+        self._watch_conn: Optional[sqlite3.Connection] = None
         self._init_db()
 
     def _conn(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        """One long-lived connection per thread (sqlite3 connections are not shareable across threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA mmap_size=134217728")
+            self._local.conn = conn
         return conn
 
     def _init_db(self):
@@ -66,15 +94,17 @@ class SQLiteQueue(QueueBackend):
                 )
             """)
             conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_api_key ON jobs(api_key)")
+            # Covers count_requests (api_key + created_at range); supersedes the old api_key-only index
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_api_key_created ON jobs(api_key, created_at)")
+            conn.execute("DROP INDEX IF EXISTS idx_jobs_api_key")
 
     def _row_to_job(self, row) -> Job:
         return Job(
             job_id=row["job_id"], api_key=row["api_key"],
-            status=JobStatus(row["status"]), request=json.loads(row["request"]),
+            status=JobStatus(row["status"]), request=orjson.loads(row["request"]),
             created_at=datetime.fromisoformat(row["created_at"]),
             updated_at=datetime.fromisoformat(row["updated_at"]),
-            result=json.loads(row["result"] or "{}"), error=row["error"],
+            result=orjson.loads(row["result"] or "{}"), error=row["error"],
             progress=row["progress"], panels_completed=row["panels_completed"],
         )
 
@@ -84,7 +114,7 @@ class SQLiteQueue(QueueBackend):
         with self._conn() as conn:
             conn.execute(
                 "INSERT INTO jobs (job_id, api_key, status, request, created_at, updated_at) VALUES (?,?,?,?,?,?)",
-                (job_id, api_key, JobStatus.pending.value, request.model_dump_json(), now, now),
+                (job_id, api_key, JobStatus.pending.value, request.model_dump_json(exclude_none=True), now, now),
             )
         return self.get_job(job_id)
 
@@ -118,7 +148,7 @@ class SQLiteQueue(QueueBackend):
                 vals.append(kwargs[k])
         if "result" in kwargs:
             sets.append("result = ?")
-            vals.append(json.dumps(kwargs["result"]))
+            vals.append(orjson.dumps(kwargs["result"]).decode())  # TEXT column
         vals.append(job_id)
         with self._conn() as conn:
             conn.execute(f"UPDATE jobs SET {', '.join(sets)} WHERE job_id = ?", vals)
@@ -131,6 +161,29 @@ class SQLiteQueue(QueueBackend):
             ).fetchone()
         return row["cnt"] if row else 0
 
+    def _data_version(self) -> int:
+        """Changes whenever another connection (e.g. the API process) commits to the database."""
+        if self._watch_conn is None:
+            self._watch_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    async def wait_for_job(self, timeout: float) -> Optional[Job]:
+        # Jobs are enqueued by another process, so there is nothing to push a wakeup. Instead watch
+        # PRAGMA data_version (a header read, no table access) every watch_interval and only run
+        # the claim query once something has been committed.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            version = self._data_version()
+            job = self.next_pending()
+            if job:
+                return job
+            while self._data_version() == version:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                await asyncio.sleep(min(self.watch_interval, remaining))
+
 
 def create_queue() -> QueueBackend:
     from .config import settings
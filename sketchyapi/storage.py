@@ -2,8 +2,10 @@
 
 from __future__ import annotations
 import abc
+import os
+import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
 from .config import settings
 
@@ -18,6 +20,13 @@ class StorageBackend(abc.ABC):
     @abc.abstractmethod
     def exists(self, key: str) -> bool: ...
 
+    def save_file(self, key: str, write: Callable[[Path], None], content_type: str = "image/png") -> str:
+        """Save the file produced by ``write(path)``. Backends that can write in place override this."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / Path(key).name
+            write(path)
+            return self.save(key, path.read_bytes(), content_type)
+
 
 class LocalStorage(StorageBackend):
     def __init__(self, base_dir: Path, base_url: str):
@@ -28,12 +37,28 @@ class LocalStorage(StorageBackend):
     def _path(self, key: str) -> Path:
         return self.base_dir / key
 
+    def path_for(self, key: str) -> Path:
+        """Filesystem path of a stored key (lets the API hand files to the OS via sendfile)."""
+        return self._path(key)
+
     def save(self, key: str, data: bytes, content_type: str = "image/png") -> str:
         path = self._path(key)
         path.parent.mkdir(parents=True, exist_ok=True)
         path.write_bytes(data)
         return self.url(key)
 
+    def save_file(self, key: str, write: Callable[[Path], None], content_type: str = "image/png") -> str:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write beside the target and rename so readers never see a partial file
+        tmp = path.with_name(f".{path.name}.tmp")
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return self.url(key)
+
     def get(self, key: str) -> Optional[bytes]:
         path = self._path(key)
         return path.read_bytes() if path.exists() else None
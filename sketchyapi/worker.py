@@ -2,153 +2,359 @@
 
 from __future__ import annotations
 import asyncio
-import json
+import functools
 import logging
-import re
-import traceback
+import multiprocessing
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
 
 import httpx
+import orjson
+from selectolax.lexbor import LexborHTMLParser
 
 from .config import settings
 from .models import JobStatus, Tone, Language, WebhookPayload
 from .queue_service import QueueBackend, Job, create_queue
-from .storage import StorageBackend, create_storage
+from .storage import LocalStorage, StorageBackend, create_storage
 from .script_writer import ScriptWriter, create_script_writer
-from .engine.comfyui import generate_image
-from .engine.assembler import assemble_comic
+from .engine.comfyui import generate_images
+from .engine.assembler import assemble_comic, init_pil
 
 logger = logging.getLogger("sketchy.worker")
 
+# Elements whose text is never part of the article body
+_STRIP_TAGS = ["script", "style", "nav", "footer", "aside"]
+# Only ~4000 chars of article text are used, so stop downloading long before a multi-MB page ends
+_ARTICLE_MAX_BYTES = 256 * 1024
 
-async def send_webhook(url: str, payload: WebhookPayload) -> bool:
-    """Send webhook notification."""
-    try:
-        async with httpx.AsyncClient(timeout=settings.webhook_timeout) as client:
-            resp = await client.post(url, json=payload.model_dump(mode="json"))
-            logger.info(f"Webhook {url} → {resp.status_code}")
-            return 200 <= resp.status_code < 300
-    except Exception as e:
-        logger.warning(f"Webhook failed: {e}")
+# Minimum seconds between panel-progress writes to the queue
+_PROGRESS_INTERVAL = 1.0
+
+# Strong references to in-flight fire-and-forget webhook deliveries
+_webhook_tasks: set[asyncio.Task] = set()
+
+# Full-jitter exponential backoff between webhook attempts: sleep U(0, min(cap, base * 2**attempt))
+_WEBHOOK_BACKOFF_BASE, _WEBHOOK_BACKOFF_CAP = 0.5, 32.0
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class _CircuitBreaker:
+    """Per-URL breaker: opens after ``threshold`` failed deliveries in a row, then lets a single
+    trial delivery through every ``cooldown`` seconds until one succeeds."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            self.opened_at = time.monotonic()  # half-open: one trial per cooldown window
+            return True
         return False
 
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
 
-async def process_job(job: Job, queue: QueueBackend, storage: StorageBackend, writer: ScriptWriter):
-    """Process a single job end-to-end."""
-    job_id = job.job_id
-    request = job.request
-    num_panels = request.get("panels", 18)
 
-    try:
-        # 1. Write script
-        queue.update_status(job_id, JobStatus.writing_script, progress="Writing satirical script...")
-        logger.info(f"[{job_id}] Writing script...")
+# Breakers for URLs whose last delivery failed, least recently failed first. A success drops the
+# URL's entry and the oldest entries are evicted past _MAX_BREAKERS, so arbitrary URLs can't pile up.
+_breakers: OrderedDict[str, _CircuitBreaker] = OrderedDict()
+_MAX_BREAKERS = 1024
 
-        article_text = request.get("article_text", "")
-        article_url = request.get("article_url")
 
-        if not article_text and article_url:
-            try:
-                async with httpx.AsyncClient(timeout=15) as client:
-                    resp = await client.get(article_url, follow_redirects=True)
-                    html = resp.text
-                    for tag in ["script", "style", "nav", "footer", "aside"]:
-                        html = re.sub(f"<{tag}[^>]*>.*?</{tag}>", "", html, flags=re.DOTALL | re.IGNORECASE)
-                    article_text = re.sub(r"<[^>]+>", " ", html)
-                    article_text = re.sub(r"\s+", " ", article_text).strip()[:4000]
-            except Exception as e:
-                logger.warning(f"[{job_id}] Failed to fetch article: {e}")
-                if not article_text:
-                    raise ValueError(f"Cannot fetch article from {article_url}: {e}")
-
-        script = await writer.write_script(
-            article_text=article_text,
-            article_url=article_url,
-            title=request.get("title"),
-            num_panels=num_panels,
-            tone=Tone(request.get("tone", "sharp")),
-            style=request.get("style", ""),
-            language=Language(request.get("language", "en")),
-            category=request.get("category"),
-        )
-
-        if script.get("_prompt_only"):
-            queue.update_status(job_id, JobStatus.completed, result=script)
-            return
-
-        title = script.get("title", "Untitled")
-        storage.save(f"{job_id}/script.json", json.dumps(script, indent=2, ensure_ascii=False).encode())
-
-        # 2. Generate images
-        queue.update_status(job_id, JobStatus.generating_images, progress=f"Generating panel 1/{num_panels}...")
-        logger.info(f"[{job_id}] Generating {num_panels} panels...")
-
-        panels_data: list[tuple[bytes, str]] = []
-        panel_urls = []
-
-        for i, panel in enumerate(script.get("panels", [])[:num_panels]):
-            queue.update_status(
-                job_id, JobStatus.generating_images,
-                progress=f"Generating panel {i + 1}/{num_panels}...",
-                panels_completed=i,
-            )
+async def send_webhook(
+    url: str, payload: WebhookPayload, client: httpx.AsyncClient | None = None, use_breaker: bool = True,
+    retries: int | None = None,
+) -> bool:
+    """Send webhook notification over ``client`` (a pooled client), or a one-off client if None.
 
-            img_bytes = await asyncio.to_thread(
-                generate_image,
-                panel["scene_prompt"],
-                settings.comfyui_url,
-                settings.comfyui_checkpoint,
-                settings.comfyui_steps,
+    With ``use_breaker=False`` the URL is contacted even if its circuit is open, and the outcome
+    is not recorded. ``retries`` overrides webhook_max_retries (the test endpoint makes one attempt).
+    """
+    breaker = _breakers.get(url) if use_breaker else None
+    if breaker is not None and not breaker.allow():
+        logger.warning(f"Webhook {url} skipped: circuit open after {breaker.failures} failures")
+        return False
+
+    if client is None:
+        async with httpx.AsyncClient(timeout=settings.webhook_timeout) as one_off:
+            ok = await _deliver_webhook(one_off, url, payload, retries)
+    else:
+        ok = await _deliver_webhook(client, url, payload, retries)
+
+    if use_breaker:
+        if ok:
+            _breakers.pop(url, None)
+        else:
+            # Re-insert as most recent; the entry may have been evicted while this delivery ran
+            breaker = _breakers.pop(url, None) or _CircuitBreaker(
+                settings.webhook_breaker_threshold, settings.webhook_breaker_cooldown,
             )
+            _breakers[url] = breaker
+            while len(_breakers) > _MAX_BREAKERS:
+                _breakers.popitem(last=False)
+            breaker.record_failure()
+    return ok
+
+
+async def _deliver_webhook(
+    client: httpx.AsyncClient, url: str, payload: WebhookPayload, retries: int | None = None,
+) -> bool:
+    """POST the payload, retrying network errors, 429 and 5xx up to ``retries`` (default
+    webhook_max_retries) times."""
+    if retries is None:
+        retries = settings.webhook_max_retries
+    body = payload.model_dump_json().encode()  # serialized once, reused across retries
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(random.uniform(0, min(_WEBHOOK_BACKOFF_CAP, _WEBHOOK_BACKOFF_BASE * 2 ** attempt)))
+        try:
+            resp = await client.post(url, content=body, headers=_JSON_HEADERS)
+        except httpx.UnsupportedProtocol as e:  # a bad scheme won't fix itself on retry
+            logger.warning(f"Webhook failed: {e}")
+            return False
+        except httpx.TransportError as e:
+            logger.warning(f"Webhook {url} attempt {attempt + 1} failed: {e}")
+            continue
+        except Exception as e:
+            logger.warning(f"Webhook failed: {e}")
+            return False
+        logger.info(f"Webhook {url} → {resp.status_code}")
+        if 200 <= resp.status_code < 300:
+            return True
+        if resp.status_code != 429 and resp.status_code < 500:
+            return False
+    return False
+
+
+def dispatch_webhook(url: str, payload: WebhookPayload, client: httpx.AsyncClient | None = None) -> None:
+    """Deliver a webhook in the background so the worker can move on to the next job."""
+    task = asyncio.create_task(send_webhook(url, payload, client))
+    _webhook_tasks.add(task)
+    task.add_done_callback(_webhook_tasks.discard)
+
+
+def _strip_html(html: str) -> str:
+    """Reduce an article page to whitespace-normalized visible text."""
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(_STRIP_TAGS)
+    if tree.root is None:
+        return ""
+    return " ".join(tree.root.text(separator=" ").split())
+
+
+async def _fetch_article(client: httpx.AsyncClient, url: str) -> str:
+    """Download the start of an article and return its text."""
+    buf = bytearray()
+    async with client.stream("GET", url, follow_redirects=True, timeout=15) as resp:
+        async for chunk in resp.aiter_bytes():
+            buf.extend(chunk)
+            if len(buf) >= _ARTICLE_MAX_BYTES:
+                break
+        encoding = resp.charset_encoding or "utf-8"
+        content_type = resp.headers.get("content-type", "").lower()
+    try:
+        text = buf.decode(encoding, errors="replace")
+    except LookupError:  # unknown charset label
+        text = buf.decode("utf-8", errors="replace")
+    # Only parse markup when the server says it's HTML (or says nothing); JSON, RSS or plain text
+    # bodies skip the parser and just get their whitespace collapsed
+    if content_type and "html" not in content_type:
+        return " ".join(text.split())[:4000]
+    return _strip_html(text)[:4000]
+
+
+async def process_job(
+    job: Job, queue: QueueBackend, storage: StorageBackend, writer: ScriptWriter, client: httpx.AsyncClient,
+    gen_executor: ThreadPoolExecutor | None = None, cpu_pool: ProcessPoolExecutor | None = None,
+    generation_done: asyncio.Event | None = None,
+):
+    """Process a single job end-to-end.
+
+    ``client`` is the worker's shared HTTP client; ComfyUI calls block a thread each and run on
+    ``gen_executor`` (the loop's default executor if None). The comic is assembled in ``cpu_pool``,
+    or in a thread of this process if None. ``generation_done`` is set once the job no longer
+    needs ComfyUI (assembly started, or the job ended), so the caller can start the next one.
+    """
+    job_id = job.job_id
+    request = job.request
+    num_panels = request.get("panels", 18)
+    webhook_url = request.get("webhook_url")
 
-            key = f"{job_id}/panels/panel_{i + 1:02d}.png"
-            url = storage.save(key, img_bytes, "image/png")
-            panel_urls.append(url)
-            panels_data.append((img_bytes, panel.get("dialogue", "")))
-            logger.info(f"[{job_id}] Panel {i + 1}/{num_panels} ✓")
-
-        # 3. Assemble
-        queue.update_status(job_id, JobStatus.assembling, progress="Assembling comic...", panels_completed=num_panels)
-        logger.info(f"[{job_id}] Assembling...")
-
-        combined_bytes = await asyncio.to_thread(assemble_comic, panels_data, title, num_panels)
-        combined_key = f"{job_id}/combined.png"
-        combined_url = storage.save(combined_key, combined_bytes, "image/png")
-
-        # 4. Done
-        result = {
-            "title": title,
-            "combined_image_url": combined_url,
-            "panels": [
-                {
-                    "index": i + 1,
-                    "character": p.get("character", ""),
-                    "dialogue": p.get("dialogue", ""),
-                    "image_url": panel_urls[i],
-                }
-                for i, p in enumerate(script.get("panels", [])[:num_panels])
-            ],
-        }
-        queue.update_status(job_id, JobStatus.completed, result=result, panels_completed=num_panels)
-        logger.info(f"[{job_id}] ✅ Completed!")
-
-        webhook_url = request.get("webhook_url")
-        if webhook_url:
-            payload = WebhookPayload(
-                event="comic.completed", job_id=job_id, status=JobStatus.completed,
-                combined_image_url=combined_url, panels_count=num_panels, title=title,
+    # One deadline for the whole job, so a hung ComfyUI or LLM call can't pin the worker. Cancelling
+    # doesn't stop blocking work in threads or processes, so they get deadline_at and stop themselves.
+    deadline = asyncio.timeout(settings.job_deadline)
+    deadline_at = time.monotonic() + settings.job_deadline
+    try:
+        async with deadline:
+            # 1. Write script
+            await queue.update_status_async(job_id, JobStatus.writing_script, progress="Writing satirical script...")
+            logger.info(f"[{job_id}] Writing script...")
+
+            article_text = request.get("article_text", "")
+            article_url = request.get("article_url")
+
+            if not article_text and article_url:
+                try:
+                    article_text = await _fetch_article(client, article_url)
+                except Exception as e:
+                    logger.warning(f"[{job_id}] Failed to fetch article: {e}")
+                    if not article_text:
+                        raise ValueError(f"Cannot fetch article from {article_url}: {e}")
+
+            script = await writer.write_script(
+                article_text=article_text,
+                article_url=article_url,
+                title=request.get("title"),
+                num_panels=num_panels,
+                tone=Tone(request.get("tone", "sharp")),
+                style=request.get("style", ""),
+                language=Language(request.get("language", "en")),
+                category=request.get("category"),
             )
-            await send_webhook(webhook_url, payload)
+
+            if script.get("_prompt_only"):
+                await queue.update_status_async(job_id, JobStatus.completed, result=script)
+                return
+
+            title = script.get("title", "Untitled")
+            panels = script.get("panels", [])[:num_panels]
+            characters = [p.get("character", "") for p in panels]
+            dialogues = [p.get("dialogue", "") for p in panels]
+            storage.save(f"{job_id}/script.json", orjson.dumps(script, option=orjson.OPT_INDENT_2))
+
+            # 2. Generate images
+            await queue.update_status_async(job_id, JobStatus.generating_images, progress=f"Generating panel 1/{num_panels}...")
+            logger.info(f"[{job_id}] Generating {num_panels} panels...")
+
+            # Panels are independent: keep up to comfyui_concurrency workflows queued on ComfyUI so it
+            # never idles between HTTP round-trips. Consecutive panels are grouped into
+            # comfyui_batch_size workflows; results land in preallocated slots to keep panel order.
+            loop = asyncio.get_running_loop()
+            sem = asyncio.Semaphore(settings.comfyui_concurrency)
+            # Tells generation threads to drop their prompts from ComfyUI once the job can't use them
+            cancel_generation = threading.Event()
+            batch_size = max(1, settings.comfyui_batch_size)
+            batches = [range(start, min(start + batch_size, len(panels)))
+                       for start in range(0, len(panels), batch_size)]
+
+            async def _gen(batch: range) -> tuple[range, list[bytes]]:
+                async with sem:
+                    images = await loop.run_in_executor(gen_executor, functools.partial(
+                        generate_images,
+                        [panels[i]["scene_prompt"] for i in batch],
+                        settings.comfyui_url,
+                        settings.comfyui_checkpoint,
+                        settings.comfyui_steps,
+                        deadline=deadline_at,
+                        cancel=cancel_generation,
+                    ))
+                return batch, images
+
+            # Panel uploads run in threads alongside generation and are collected before assembly
+            uploads: list[asyncio.Task | None] = [None] * len(panels)
+            # Local panels are re-read from disk by the assembler, so their bytes can be dropped right away
+            panels_data: list[tuple[bytes | Path, str] | None] = [None] * len(panels)
+            completed = 0
+            # Progress writes are coalesced to at most one per _PROGRESS_INTERVAL, plus the final panel
+            last_progress = time.monotonic()
+            tasks = [asyncio.create_task(_gen(batch)) for batch in batches]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    batch, images = await next_done
+                    for i, img_bytes in zip(batch, images):
+                        key = f"{job_id}/panels/panel_{i + 1:02d}.png"
+                        uploads[i] = asyncio.create_task(asyncio.to_thread(storage.save, key, img_bytes, "image/png"))
+                        src = storage.path_for(key) if isinstance(storage, LocalStorage) else img_bytes
+                        panels_data[i] = (src, dialogues[i])
+                        logger.info(f"[{job_id}] Panel {i + 1}/{num_panels} ✓")
+                    completed += len(batch)
+                    now = time.monotonic()
+                    if now - last_progress >= _PROGRESS_INTERVAL or completed == len(panels):
+                        last_progress = now
+                        await queue.update_status_async(
+                            job_id, JobStatus.generating_images,
+                            progress=f"Generated {completed}/{num_panels} panels...",
+                            panels_completed=completed,
+                        )
+
+                # ComfyUI is done with this job; only the uploads remain before assembly
+                if generation_done is not None:
+                    generation_done.set()
+                panel_urls = await asyncio.gather(*uploads)
+            finally:
+                # On failure, don't leave sibling batches or uploads waiting to start, nor prompts
+                # already queued on ComfyUI running for nobody
+                cancel_generation.set()
+                for task in (*tasks, *(u for u in uploads if u is not None)):
+                    task.cancel()
+
+            # 3. Assemble
+            await queue.update_status_async(job_id, JobStatus.assembling, progress="Assembling comic...", panels_completed=num_panels)
+            logger.info(f"[{job_id}] Assembling...")
+
+            # Encode straight into storage instead of materializing the PNG as bytes first. Compositing
+            # is CPU-bound, so it runs in cpu_pool when given; local panels cross over as paths.
+            def _write(path: Path) -> None:
+                if cpu_pool is None:
+                    assemble_comic(panels_data, title, num_panels, output=path)
+                else:
+                    cpu_pool.submit(assemble_comic, panels_data, title, num_panels, path).result()
+                # Raising here leaves the target untouched for a job that has already been failed
+                if deadline.expired():
+                    raise TimeoutError(f"Job exceeded deadline of {settings.job_deadline}s")
+
+            combined_key = f"{job_id}/combined.png"
+            combined_url = await asyncio.to_thread(storage.save_file, combined_key, _write, "image/png")
+
+            # 4. Done
+            result = {
+                "title": title,
+                "combined_image_url": combined_url,
+                "panels": [
+                    {
+                        "index": i + 1,
+                        "character": characters[i],
+                        "dialogue": dialogues[i],
+                        "image_url": panel_urls[i],
+                    }
+                    for i in range(len(panels))
+                ],
+            }
+            await queue.update_status_async(job_id, JobStatus.completed, result=result, panels_completed=num_panels)
+            logger.info(f"[{job_id}] ✅ Completed!")
+
+            if webhook_url:
+                payload = WebhookPayload(
+                    event="comic.completed", job_id=job_id, status=JobStatus.completed,
+                    combined_image_url=combined_url, panels_count=num_panels, title=title,
+                )
+                dispatch_webhook(webhook_url, payload, client)
 
     except Exception as e:
-        logger.error(f"[{job_id}] ❌ Failed: {e}\n{traceback.format_exc()}")
-        queue.update_status(job_id, JobStatus.failed, error=str(e))
+        error = f"Job exceeded deadline of {settings.job_deadline}s" if deadline.expired() else str(e)
+        logger.error("[%s] ❌ Failed: %s", job_id, error, exc_info=True)
+        await queue.update_status_async(job_id, JobStatus.failed, error=error)
 
-        webhook_url = request.get("webhook_url")
         if webhook_url:
             payload = WebhookPayload(
-                event="comic.failed", job_id=job_id, status=JobStatus.failed, error=str(e),
+                event="comic.failed", job_id=job_id, status=JobStatus.failed, error=error,
             )
-            await send_webhook(webhook_url, payload)
+            dispatch_webhook(webhook_url, payload, client)
+
+    finally:
+        if generation_done is not None:
+            generation_done.set()
 
 
 async def worker_loop():
@@ -156,29 +362,78 @@ async def worker_loop():
     queue = create_queue()
     storage = create_storage()
     writer = create_script_writer()
+    init_pil()
+
+    # One pooled client for article fetches and webhooks, so keep-alive/TLS sessions are reused across jobs
+    client = httpx.AsyncClient(
+        timeout=settings.webhook_timeout,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        http2=True,
+    )
+    # Sized to the ComfyUI fan-out so generation threads neither queue behind nor starve other blocking work
+    gen_executor = ThreadPoolExecutor(max_workers=settings.comfyui_concurrency, thread_name_prefix="comfyui")
+    # Long-lived assembler processes, so Pillow compositing isn't bound by this process's GIL. Spawned
+    # rather than forked: the parent already runs an event loop and executor threads.
+    cpu_pool = ProcessPoolExecutor(
+        max_workers=settings.worker_max_concurrent,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_pil,
+    )
 
     logger.info(f"Worker started (poll={settings.worker_poll_interval}s, backend={settings.queue_backend})")
 
-    while True:
-        try:
-            job = queue.next_pending()
-            if job:
-                logger.info(f"Claimed job {job.job_id}")
-                await process_job(job, queue, storage, writer)
-            else:
+    # Jobs in flight: the next job is claimed as soon as the current one finishes generating, so its
+    # script and panels overlap the previous job's assembly and upload
+    running: set[asyncio.Task] = set()
+
+    def _job_finished(task: asyncio.Task) -> None:
+        running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Worker error: %s", task.exception(), exc_info=task.exception())
+
+    try:
+        while True:
+            try:
+                # One job generating plus up to worker_max_concurrent finishing assembly
+                if len(running) > settings.worker_max_concurrent:
+                    await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                job = await queue.wait_for_job(timeout=settings.worker_poll_interval)
+                if job:
+                    logger.info(f"Claimed job {job.job_id}")
+                    generation_done = asyncio.Event()
+                    task = asyncio.create_task(process_job(
+                        job, queue, storage, writer, client, gen_executor, cpu_pool, generation_done,
+                    ))
+                    running.add(task)
+                    task.add_done_callback(_job_finished)
+                    await generation_done.wait()
+            except KeyboardInterrupt:
+                logger.info("Worker shutting down.")
+                break
+            except Exception as e:
+                logger.error("Worker error: %s", e, exc_info=True)
                 await asyncio.sleep(settings.worker_poll_interval)
-        except KeyboardInterrupt:
-            logger.info("Worker shutting down.")
-            break
-        except Exception as e:
-            logger.error(f"Worker error: {e}\n{traceback.format_exc()}")
-            await asyncio.sleep(settings.worker_poll_interval)
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        # Let in-flight webhook deliveries finish before their client goes away
+        await asyncio.gather(*_webhook_tasks, return_exceptions=True)
+        await client.aclose()
+        gen_executor.shutdown(wait=False, cancel_futures=True)
+        cpu_pool.shutdown(wait=False, cancel_futures=True)
 
 
 def run_worker():
     """Entry point for standalone worker process."""
     logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
-    asyncio.run(worker_loop())
+    try:
+        import uvloop  # installed with uvicorn[standard]
+    except ImportError:
+        asyncio.run(worker_loop())
+        return
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(worker_loop())
 
 
 if __name__ == "__main__":